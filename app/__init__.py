@@ -1,31 +1,51 @@
 from flask import Flask
-from app.extensions import db
+from app.extensions import db, migrate
 from config import Config
 from celery import Celery, Task
+from redis import Redis
+import logging
+import time
 
 
 # Create the Flask app
 def create_app(config_class=Config):
-    app = Flask(__name__)  # Create the Flask app
-    app.config.from_object(config_class)  # Load the configuration file
-
-    # Initialize Flask extensions here
-    celery_init_app(app)  # Initialize Celery
-    db.init_app(app)  # Initialize the database
+    started = time.perf_counter()  # Start the startup timer
+    app = create_base_app(config_class)  # Create the Flask app with its extensions
 
     # Register blueprints here
     from app.upload import bp as upload_bp  # Import the upload blueprint
     app.register_blueprint(upload_bp)  # Register the upload blueprint
 
-    from app.models import batchimport, institution, user
-    with app.app_context():
-        db.create_all()
+    # Create and update tables as a separate deploy step (flask db upgrade), not on every process start
+    migrate.init_app(app, db)
 
     # shell context for flask cli
     @app.shell_context_processor
     def ctx():
         return {"app": app, "db": db}
 
+    app.logger.info('App created in {:.3f}s'.format(time.perf_counter() - started))  # Log startup time
+    return app
+
+
+# Create the Flask app with its extensions but without blueprints (used directly by the Celery worker)
+def create_base_app(config_class=Config):
+    app = Flask(__name__)  # Create the Flask app
+    app.config.from_object(config_class)  # Load the configuration file
+    gunicorn_logger = logging.getLogger('gunicorn.error')
+    if gunicorn_logger.handlers:  # Under gunicorn, log to its error log at its log level (--log-level, default info)
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+    if app.config["LOG_LEVEL"]:
+        app.logger.setLevel(app.config["LOG_LEVEL"])  # Set the log level
+
+    # Initialize Flask extensions here
+    celery_init_app(app)  # Initialize Celery
+    db.init_app(app)  # Initialize the database
+    app.extensions["redis"] = Redis.from_url(app.config["REDIS_URL"], decode_responses=True)  # Import control flags
+
+    from app.models import batchimport, institution, user  # Register the models
+
     return app
 
 
@@ -1,3 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 
 db = SQLAlchemy()  # Create a database object
+migrate = Migrate()  # Create a migrations object (flask db upgrade)
@@ -0,0 +1,6 @@
+from flask_wtf import FlaskForm
+
+
+# Cancel/Pause/Resume Import Form (CSRF token only)
+class ImportControlForm(FlaskForm):
+    pass
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import SelectField
-from wtforms.validators import DataRequired
+from wtforms import SelectField, DateTimeLocalField, IntegerField
+from wtforms.validators import DataRequired, Optional, NumberRange
 
 
 # Upload Form
@@ -68,3 +68,5 @@ class UploadForm(FlaskForm):
         'retention_reason',
         'retention_note'
     ], default='internal_note_1', validators=[DataRequired()])
+    start = DateTimeLocalField('Start Time', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    rowsperhour = IntegerField('Max Rows per Hour', validators=[Optional(), NumberRange(min=1)])
@@ -1,4 +1,16 @@
-from app import create_app
+import time
 
-flask_app = create_app()
-celery_app = flask_app.extensions["celery"]
\ No newline at end of file
+started = time.perf_counter()  # Start the startup timer before importing the app, Celery and their dependencies
+
+from app import create_base_app
+from celery.signals import worker_ready
+
+flask_app = create_base_app()  # Lean app for the worker: extensions only, no blueprints or templates
+celery_app = flask_app.extensions["celery"]
+startup_time = time.perf_counter() - started
+
+
+# Log startup time once the worker is ready
+@worker_ready.connect
+def log_startup_time(**kwargs):
+    flask_app.logger.info('Celery app created in {:.3f}s'.format(startup_time))
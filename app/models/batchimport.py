@@ -1,5 +1,6 @@
 from app.extensions import db
-from datetime import datetime
+from datetime import datetime, timezone
+import json
 from app.models.user import User
 from app.models.institution import Institution
 
@@ -7,30 +8,88 @@ from app.models.institution import Institution
 # BatchImport model
 class BatchImport(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    uuid = db.Column(db.String(255), nullable=False)
+    uuid = db.Column(db.String(255), nullable=False, unique=True, index=True)
     filename = db.Column(db.String(255), nullable=False)
     field = db.Column(db.String(255), nullable=False)
     date = db.Column(db.DateTime, nullable=False)
-    user = db.Column(db.String(255), nullable=False)
-    institution = db.Column(db.String(255), db.ForeignKey('institution.code'), nullable=False)
+    user = db.Column(db.String(255), nullable=False, index=True)
+    institution = db.Column(db.String(255), db.ForeignKey('institution.code'), nullable=False, index=True)
+    result = db.Column(db.Text, nullable=True)
+    start = db.Column(db.DateTime, nullable=True)
+    projected = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(255), nullable=True)
+    checkpoint = db.Column(db.Text, nullable=True)
+    due = db.Column(db.DateTime, nullable=True, index=True)
 
     def __repr__(self):
         return '<BatchImport %r>' % self.uuid
 
-    # Add the batch import to the database
+    # Add the batch import to the database (start and projected are time zone aware; all times are stored as UTC)
     @staticmethod
-    def add_batch_import(uuid, filename, field, user, institution):
+    def add_batch_import(uuid, filename, field, user, institution, start=None, projected=None, status='PENDING',
+                         checkpoint=None):
         batch_import = BatchImport(
             uuid=uuid,
             filename=filename,
             field=field,
-            date=datetime.now(),
+            date=utc(datetime.now(timezone.utc)),
             user=user,
-            institution=institution
+            institution=institution,
+            start=utc(start),
+            projected=utc(projected),
+            status=status,
+            checkpoint=json.dumps(checkpoint) if checkpoint is not None else None,
+            due=utc(start) if status == 'SCHEDULED' else None
         )
         db.session.add(batch_import)  # Add the batch import to the database
         db.session.commit()  # Commit the changes
 
+    # Set the status of the batch import, with its checkpoint for continuing, when it is next due (SCHEDULED only)
+    # or its final result summary
+    @staticmethod
+    def set_status(uuid, status, checkpoint=None, result=None, due=None):
+        batch_import = BatchImport.get_single_batch_import(uuid)
+        if batch_import is not None:
+            batch_import.status = status
+            batch_import.checkpoint = json.dumps(checkpoint) if checkpoint is not None else None
+            batch_import.due = utc(due)
+            if result is not None:
+                batch_import.result = result
+            db.session.commit()  # Commit the changes
+
+    # Get the scheduled batch imports that are due to be dispatched
+    @staticmethod
+    def get_due_batch_imports():
+        batch_imports = db.session.execute(
+            db.select(BatchImport).filter(
+                BatchImport.status == 'SCHEDULED', BatchImport.due <= utc(datetime.now(timezone.utc))
+            )
+        ).scalars().all()
+        return batch_imports
+
+    # Move the batch import to a new status only if it is still in one of the given statuses (keeps its checkpoint,
+    # clears when it is due), so the dispatcher, the task and the cancel/pause handlers can't overwrite each other
+    @staticmethod
+    def claim(uuid, statuses, status, result=None):
+        values = {'status': status, 'due': None}
+        if result is not None:
+            values['result'] = result
+        claimed = db.session.execute(
+            db.update(BatchImport).where(
+                BatchImport.uuid == uuid, BatchImport.status.in_(statuses)
+            ).values(**values)
+        ).rowcount == 1
+        db.session.commit()  # Commit the changes
+        return claimed
+
+    # Get a single batch import
+    @staticmethod
+    def get_single_batch_import(uuid):
+        batch_import = db.session.execute(
+            db.select(BatchImport).filter(BatchImport.uuid == uuid)
+        ).scalar_one_or_none()
+        return batch_import
+
     # Get the batch imports
     @staticmethod
     def get_batch_imports():
@@ -40,6 +99,13 @@ class BatchImport(db.Model):
                 BatchImport.filename,
                 BatchImport.field,
                 BatchImport.date,
+                BatchImport.result,
+                BatchImport.status,
+                BatchImport.checkpoint,
+                BatchImport.due,
+                BatchImport.start,
+                BatchImport.projected,
+                BatchImport.user.label('userid'),
                 User.displayname,
                 Institution.name
             ).join(
@@ -51,3 +117,10 @@ class BatchImport(db.Model):
             )
         ).mappings().all()
         return batch_imports
+
+
+# Time zone aware datetime as naive UTC for the database
+def utc(value):
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
@@ -1,37 +1,108 @@
 from flask import current_app
 from celery import shared_task
+from celery.exceptions import Ignore
+from app.extensions import db
+from app.models.batchimport import BatchImport
+from app.models.institution import Institution
+from app.models.user import User
+from datetime import datetime, timedelta, timezone
+from werkzeug.utils import secure_filename
+import os
 import requests
+from urllib.parse import urlparse
 import chardet
 import csv
-import json
+import orjson
 import smtplib
+import time
 import email.message
 
 
 # Celery task
-@shared_task
-def batch(csvfile, almafield, useremail, key):
+@shared_task(bind=True)
+def batch(self, csvfile, almafield, useremail, key, start_row=1, success=0, failed=0, emailbody=None,
+          rows_per_hour=None, offset=0, encoding=None, wire_bytes=0, wire_rows=0):
+    try:
+        return run_batch(self, csvfile, almafield, useremail, key, start_row, success, failed, emailbody,
+                         rows_per_hour, offset, encoding, wire_bytes, wire_rows)
+    except Ignore:  # Paused or waiting for the next chunk
+        raise
+    except Exception as e:  # Save the failure so it outlives the task result
+        filename = csvfile.replace('app/static/csv/', '')
+        current_app.logger.error('Import of {} failed: {}'.format(filename, e))
+        BatchImport.set_status(self.request.id, 'FAILURE', result='Import of {} failed: {}'.format(filename, e))
+        raise
+
+
+# Update the Alma items in a CSV file, from start_row (at byte offset) on
+def run_batch(task, csvfile, almafield, useremail, key, start_row, success, failed, emailbody, rows_per_hour, offset,
+              encoding, wire_bytes, wire_rows):
     filename = csvfile.replace('app/static/csv/', '')  # Set filename for email log
-    emailbody = 'Results for {}:\n'.format(filename)  # Initialize email body
+    if emailbody is None:  # If this isn't a resumed import...
+        emailbody = 'Results for {}:\n'.format(filename)  # ...initialize email body
+    status = 'SUCCESS'  # Initialize final status
+    if not BatchImport.claim(task.request.id, ['PENDING'], 'STARTED'):  # Cancelled or paused while queued
+        current_app.logger.info('Import of {} was cancelled or paused before it started'.format(filename))
+        return None
 
-    with open(csvfile) as csv_file:  # Open CSV file
-        encoding = chardet.detect(csv_file.read().encode())['encoding']  # Detect encoding
+    if encoding is None:  # Detect encoding once; resumed imports and later chunks carry it in their checkpoint
+        with open(csvfile) as csv_file:  # Open CSV file
+            encoding = chardet.detect(csv_file.read().encode())['encoding']  # Detect encoding
 
     with open(csvfile, encoding=encoding) as csv_file:  # Open CSV file
-        csv_reader = csv.reader(csv_file, delimiter=',')  # Open CSV file for reading
-        rownumber = 1  # Initialize row number for email log
-        failed = 0  # Initialize failed row counter for email log
-        success = 0  # Initialize success row counter for email log
+        csv_file.seek(offset)  # Go to the first row not yet processed
+        rownumber = start_row  # Initialize row number for email log (later than 1 if resumed)
+        meter = WireMeter(wire_bytes, wire_rows)  # Bytes on wire per row for the benchmark log (from earlier chunks)
+        chunkstart = time.monotonic()  # Start the throttle timer
+        chunkrows = throttle_chunk_rows(rows_per_hour)  # Rows to process before waiting (None = no throttle)
         current_app.logger.info('Processing CSV file: ' + filename)  # Log info
 
-        for row in csv_reader:  # Iterate through each row of the CSV file
+        # Reuse connections (requests already asks for gzip-compressed responses) and measure bytes on wire
+        http = requests.Session()
+        http.headers.update({'accept': 'application/json'})
+        http.hooks['response'].append(meter.response)
+
+        # Iterate through each row of the CSV file with the offset it starts at
+        for row, offset in read_rows(csv_file):
+            control = get_control(task.request.id)  # Check for a cancel/pause request (Redis, not the DB)
+
+            if control == 'cancel':  # If the user cancelled the import...
+                current_app.logger.info('Import of {} cancelled at row {}'.format(filename, rownumber))
+                emailbody += 'Import cancelled before row {}.\n'.format(rownumber)
+                status = 'CANCELLED'
+                break  # ...stop processing and report the partial results
+
+            if control == 'pause':  # If the user paused the import...
+                current_app.logger.info('Import of {} paused at row {}'.format(filename, rownumber))
+                meter.next_row()  # Finish measuring the last row
+                # ...store a checkpoint for resuming
+                BatchImport.set_status(task.request.id, 'PAUSED',
+                                       checkpoint=checkpoint(rownumber, offset, encoding, success, failed, emailbody,
+                                                             rows_per_hour, meter))
+                raise Ignore()  # ...and release the worker
+
+            if chunkrows is not None and rownumber - start_row == chunkrows:  # If this chunk is done...
+                chunktime = chunkrows * 3600 / rows_per_hour  # Seconds this chunk is allowed at the max rate
+                countdown = max(0, chunktime - (time.monotonic() - chunkstart))
+                current_app.logger.info('Import of {} throttled at row {}, next chunk in {:.0f}s'.format(
+                    filename, rownumber, countdown
+                ))
+                meter.next_row()  # Finish measuring the last row
+                # ...store a checkpoint for dispatch_scheduled to queue the next chunk when it is due
+                BatchImport.set_status(task.request.id, 'SCHEDULED',
+                                       checkpoint=checkpoint(rownumber, offset, encoding, success, failed, emailbody,
+                                                             rows_per_hour, meter),
+                                       due=datetime.now(timezone.utc) + timedelta(seconds=countdown))
+                raise Ignore()  # ...and release the worker until then
+
+            meter.next_row()  # Start measuring this row
             barcode = row[0]  # Column 1 = barcode
             note = row[1]  # Column 2 = value to insert as a note
 
             current_app.logger.info('Processing barcode {}...'.format(barcode))
 
             try:  # Get item record from barcode via requests
-                r = requests.get(current_app.config['ALMA_SERVER'] + '/almaws/v1/items', params={
+                r = http.get(current_app.config['ALMA_SERVER'] + '/almaws/v1/items', params={
                     'apikey': key,
                     'item_barcode': barcode,
                     'format': 'json'
@@ -49,7 +120,7 @@ def batch(csvfile, almafield, useremail, key):
 
             current_app.logger.debug('Barcode {} found.'.format(barcode))
 
-            itemrec = r.json()  # If request good, parse JSON into a variable
+            itemrec = orjson.loads(r.content)  # If request good, parse JSON into a variable
             if almafield in value_desc_fields:
 
                 if '|' in note:
@@ -84,10 +155,16 @@ def batch(csvfile, almafield, useremail, key):
             putendpoint = '/almaws/v1/bibs/' + mms_id + '/holdings/' + holding_id + '/items/' + item_pid
             current_app.logger.debug('Updating barcode {}...'.format(barcode))
 
-            try:  # send full updated JSON item record via PUT request
-                r = requests.put(current_app.config['ALMA_SERVER'] + putendpoint, params={
+            # Alma ignores bib_data on item updates, so leave it out of the PUT request
+            putrec = {
+                'holding_data': itemrec['holding_data'],
+                'item_data': itemrec['item_data']
+            }
+
+            try:  # send updated JSON item record via PUT request
+                r = http.put(current_app.config['ALMA_SERVER'] + putendpoint, params={
                     'apikey': key
-                }, data=json.dumps(itemrec), headers=headers)
+                }, data=orjson.dumps(putrec), headers=headers)
                 r.raise_for_status()  # Provide for reporting HTTP errors
 
             except Exception as errh:  # If error...
@@ -104,23 +181,56 @@ def batch(csvfile, almafield, useremail, key):
             rownumber = rownumber + 1  # Bump the row number up before going to next row
             success = success + 1
 
+        http.close()  # Close the session's connections
+        meter.next_row()  # Finish measuring the last row
+
+    # Log bytes on wire per row for benchmarking
+    if meter.rows > 0:
+        current_app.logger.info('{}: {} bytes on wire for {} measured rows ({:.0f} bytes/row)'.format(
+            filename, meter.bytes, meter.rows, meter.bytes / meter.rows
+        ))
+
     # Provide import info as output to command line
-    emailbody += str(success) + ' barcodes updated.\n'
-    emailbody += str(failed) + ' barcodes not updated.'
-    if failed > 0:
-        emailbody += ' (See errors above.)'
+    emailbody = summarize(emailbody, success, failed)
+
+    clear_control(task.request.id)  # Remove any leftover cancel/pause request
 
     # Send email to user
     message = send_email(emailbody, filename, useremail)
     emailbody += '\n' + message  # Add email message to email body
 
+    BatchImport.set_status(task.request.id, status, result=emailbody)  # Save the summary so it outlives the task
+
     return emailbody  # Return email body for testing
 
 
+# Celery beat task: queue scheduled imports and throttled chunks that are due
+@shared_task
+def dispatch_scheduled():
+    for batch_import in BatchImport.get_due_batch_imports():
+        if BatchImport.claim(batch_import.uuid, ['SCHEDULED'], 'PENDING'):  # Skip imports another dispatch, pause or cancel got to
+            dispatch_batch(batch_import)
+
+
 ####################
 # Helper functions #
 ####################
 
+# Queue a batch import from its checkpoint under its own task id
+def dispatch_batch(batch_import):
+    checkpoint = orjson.loads(batch_import.checkpoint) if batch_import.checkpoint else {}
+    importer = db.session.get(User, int(batch_import.user))  # Results go to the user who uploaded the CSV
+    apikey = Institution.get_single_institution(batch_import.institution).apikey
+    batch.apply_async(
+        args=[
+            os.path.join(current_app.config['UPLOAD_FOLDER'], secure_filename(batch_import.filename)),
+            batch_import.field, importer.emailaddress, apikey
+        ],
+        kwargs=checkpoint,
+        task_id=batch_import.uuid
+    )
+
+
 # Send email
 def send_email(body, filename, useremail):
     message = email.message.Message()  # create message
@@ -144,6 +254,142 @@ def send_email(body, filename, useremail):
     return message  # return message for logging
 
 
+# Bytes on wire per row: request lines, headers and bodies plus response status lines, headers and bodies as sent
+# (compressed). Chunked responses don't report their compressed size, so rows with a response without a
+# content-length are left out. Totals are carried across chunks and pauses in the checkpoint
+class WireMeter:
+    def __init__(self, bytes=0, rows=0):
+        self.bytes = bytes  # Bytes for measured rows
+        self.rows = rows  # Measured rows
+        self.row_bytes = 0  # Bytes for the current row
+        self.row_measured = False  # Whether every response for the current row had a content-length
+
+    # Add the current row to the totals and start a new one
+    def next_row(self):
+        if self.row_measured:
+            self.bytes += self.row_bytes
+            self.rows += 1
+        self.row_bytes = 0
+        self.row_measured = True
+
+    # requests response hook (also called for redirects)
+    def response(self, r, *args, **kwargs):
+        if 'content-length' in r.headers:
+            # Host is added by the connection, not requests, and the request line includes the query string
+            request_headers = dict(r.request.headers, Host=urlparse(r.request.url).netloc)
+            self.row_bytes += head_size('{} {} HTTP/1.1'.format(r.request.method, r.request.path_url),
+                                        request_headers)
+            self.row_bytes += len(r.request.body or b'')
+            self.row_bytes += head_size('HTTP/1.1 {} {}'.format(r.status_code, r.reason), r.headers)
+            self.row_bytes += int(r.headers['content-length'])
+        else:
+            self.row_measured = False
+
+
+# Size of an HTTP request line or status line with its headers and the blank line ending them
+def head_size(start_line, headers):
+    lines = [start_line] + ['{}: {}'.format(name, value) for name, value in headers.items()]
+    return sum(len(line.encode('latin-1', 'replace')) + 2 for line in lines) + 2
+
+
+# Cancel a batch import that isn't running: queued (PENDING), waiting for its start or next chunk (SCHEDULED)
+# or PAUSED. Returns False if it started running in the meantime, so the caller must ask the task to stop instead
+def cancel_batch(batch_import):
+    saved = orjson.loads(batch_import.checkpoint) if batch_import.checkpoint else {}
+    emailbody = saved.get('emailbody') or 'Results for {}:\n'.format(batch_import.filename)
+    emailbody += 'Import cancelled before row {}.\n'.format(saved.get('start_row', 1))
+    emailbody = summarize(emailbody, saved.get('success', 0), saved.get('failed', 0))
+    queued = batch_import.status == 'PENDING'
+    if not BatchImport.claim(batch_import.uuid, ['PENDING', 'SCHEDULED', 'PAUSED'], 'CANCELLED', result=emailbody):
+        return False
+    if queued:  # Drop the queued message (the task also skips cancelled imports)
+        current_app.extensions['celery'].control.revoke(batch_import.uuid)
+    clear_control(batch_import.uuid)  # Remove any leftover pause request
+    return True
+
+
+# Pause a batch import that isn't running: queued (PENDING) or waiting for its start or next chunk (SCHEDULED).
+# Its checkpoint is kept for resuming. Returns False if it started running in the meantime
+# A queued message isn't revoked, as resuming reuses the task id: the task skips it while the import is paused
+def pause_batch(batch_import):
+    return BatchImport.claim(batch_import.uuid, ['PENDING', 'SCHEDULED'], 'PAUSED')
+
+
+# Add the updated and not updated counts to the results
+def summarize(emailbody, success, failed):
+    emailbody += str(success) + ' barcodes updated.\n'
+    emailbody += str(failed) + ' barcodes not updated.'
+    if failed > 0:
+        emailbody += ' (See errors above.)'
+    return emailbody
+
+
+# Checkpoint saved on BatchImport, also the task keyword arguments for continuing an import from a row
+def checkpoint(row, offset, encoding, success, failed, emailbody, rows_per_hour, meter):
+    return {
+        'start_row': row,
+        'offset': offset,
+        'encoding': encoding,
+        'success': success,
+        'failed': failed,
+        'emailbody': emailbody,
+        'rows_per_hour': rows_per_hour,
+        'wire_bytes': meter.bytes,
+        'wire_rows': meter.rows
+    }
+
+
+# Read CSV rows with the offset each starts at (file position cookie, for seek)
+def read_rows(csv_file):
+    position = csv_file.tell()  # Position after the last line read
+
+    def lines():
+        nonlocal position
+        for line in iter(csv_file.readline, ''):  # readline, unlike iterating the file, keeps tell() available
+            position = csv_file.tell()
+            yield line
+
+    start = position
+    for row in csv.reader(lines(), delimiter=','):
+        yield row, start
+        start = position  # The csv reader reads no further than the end of the row it returned
+
+
+# Rows to process per throttle interval for a max rows per hour
+def throttle_chunk_rows(rows_per_hour):
+    if not rows_per_hour:
+        return None
+    return max(1, round(rows_per_hour * throttle_interval / 3600))
+
+
+# Count the rows in a CSV file
+def count_rows(csvfile):
+    with open(csvfile, 'rb') as csv_file:
+        return sum(1 for line in csv_file if line.strip())
+
+
+# Get the pending control request (cancel or pause) for an import, if any
+def get_control(uuid):
+    return current_app.extensions['redis'].get(control_key(uuid))
+
+
+# Request that a running import be cancelled or paused
+def set_control(uuid, action):
+    current_app.extensions['redis'].set(control_key(uuid), action, ex=current_app.config['CONTROL_EXPIRES'])
+
+
+# Remove the control request for an import
+def clear_control(uuid):
+    current_app.extensions['redis'].delete(control_key(uuid))
+
+
+# Redis key holding the control request for an import
+def control_key(uuid):
+    return 'almanotesimport:control:{}'.format(uuid)
+
+
+throttle_interval = 300  # Target seconds between the starts of throttled chunks
+
 value_fields = [
     'provenance',
     'break_indicator',
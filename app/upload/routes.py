@@ -3,10 +3,15 @@ from pymemcache.client.base import Client as memcacheClient
 import app.forms.uploadform as uploadform
 import app.forms.institutionform as institutionform
 import app.forms.userform as userform
+import app.forms.importcontrolform as importcontrolform
 from functools import wraps
 from werkzeug.utils import secure_filename
-from app.tasks.batch import batch
+from app.tasks.batch import dispatch_batch, cancel_batch, pause_batch, set_control, clear_control, count_rows
 from celery.result import AsyncResult
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from uuid import uuid4
+import json
 import os
 from app.models.user import User
 from app.models.institution import Institution
@@ -16,6 +21,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+active_statuses = ['PENDING', 'STARTED', 'SCHEDULED', 'PAUSED']  # Imports that can be cancelled or paused
+
 
 # decorator for pages that need auth
 def auth_required(f):
@@ -36,6 +43,7 @@ def upload():
     izs = Institution.get_institutions()  # Get the institutions from the database
     form.iz.choices = [(i.code, i.name) for i in izs]  # Set the choices for the institution field
     form.iz.default = 'scf'  # Set the default institution to 'scf
+    form.start.label.text = 'Start Time ({})'.format(current_app.config['TIMEZONE'])  # Show the start time zone
     if form.validate_on_submit():
         # File
         file = form.csv.data  # Get the CSV file from the form
@@ -65,38 +73,147 @@ def upload():
 
         user = User.check_user(session['username'])  # Get the current user object
 
-        # Run the batch function on the CSV file
-        task = batch.delay(
-            os.path.join(
-                current_app.config['UPLOAD_FOLDER'], secfilename
-            ), field, user.emailaddress, apikey
-        )
+        # Schedule
+        tz = ZoneInfo(current_app.config['TIMEZONE'])
+        start = form.start.data  # Get the start time from the form (None = now)
+        if start:
+            start = start.replace(tzinfo=tz)  # The form's start time is in the app's time zone
+        rowsperhour = form.rowsperhour.data  # Get the max rows per hour from the form (None = no throttle)
+        projected = None  # Initialize the projected completion time
+        if rowsperhour:  # If throttled, project completion from the number of rows
+            rows = count_rows(os.path.join(current_app.config['UPLOAD_FOLDER'], secfilename))
+            projected = (start or datetime.now(tz)) + timedelta(hours=rows / rowsperhour)
+
+        # Add task to database before running it, so the task can save its result summary. Imports starting later
+        # wait as SCHEDULED until the dispatch_scheduled beat task queues them.
+        taskid = str(uuid4())
+        scheduled = start is not None and start > datetime.now(tz)
+        BatchImport.add_batch_import(taskid, filename, field, user.id, iz, start, projected,
+                                     status='SCHEDULED' if scheduled else 'PENDING',
+                                     checkpoint={'rows_per_hour': rowsperhour})
 
-        # Add task to database
-        BatchImport.add_batch_import(task.id, filename, field, user.id, iz)
+        # Run the batch function on the CSV file
+        if not scheduled:
+            dispatch_batch(BatchImport.get_single_batch_import(taskid))
 
         # Provide import info as message to user
-        flash(
-            'The CSV "' + filename + '" is being processed (taskid = ' + str(
-                task.id) + '). An email will be sent to {} when complete.'.format(session['email']),
-            'info'
-        )
+        when = 'is scheduled to start at {}'.format(localtime(start)) if scheduled else 'is being processed'
+        message = 'The CSV "' + filename + '" ' + when + ' (taskid = ' + taskid + ').'
+        if projected:
+            message += ' Projected completion: {}.'.format(localtime(projected))
+        flash(message + ' An email will be sent to {} when complete.'.format(session['email']), 'info')
         return redirect(url_for('upload.upload'))
 
     # Get batch imports from database
     batch_imports = BatchImport.get_batch_imports()  # Get the batch imports from the database
+    user = User.check_user(session['username'])  # Get the current user object for import controls
     imports = []  # Initialize the imports list
     for batch_import in batch_imports:  # Iterate through the batch imports
-        result = AsyncResult(batch_import.uuid).result  # Get the result of the task
+        status = batch_import.status  # Get the saved status of the import
+        result = batch_import.result  # Get the saved result summary of the import
+        if status is None:  # Imports from before statuses were saved...
+            if result is not None:
+                status = 'SUCCESS'
+            else:  # ...look up the task, whose result may have expired
+                task = AsyncResult(batch_import.uuid)
+                status = 'UNKNOWN' if task.state == 'PENDING' else task.state
+                result = task.result
+        elif status in ['PAUSED', 'SCHEDULED']:  # If the import is waiting, show its checkpoint
+            checkpoint = json.loads(batch_import.checkpoint)
+            result = checkpoint.get('emailbody', '')  # Nothing yet if the import hasn't started
+            if status == 'PAUSED':
+                result += 'Paused before row {}.'.format(checkpoint.get('start_row', 1))
+            elif 'start_row' in checkpoint:
+                result += 'Next chunk starts at row {} at {}.'.format(checkpoint['start_row'],
+                                                                     localtime(batch_import.due))
         imports.append({  # Add the batch import to the imports list with the status and result
+            'uuid': batch_import.uuid,
             'filename': batch_import.filename,
             'field': batch_import.field,
             'date': batch_import.date,
             'user': batch_import.displayname,
             'institution': batch_import.name,
+            'start': batch_import.start,
+            'projected': batch_import.projected,
+            'status': status,
+            'controllable': status in active_statuses and (
+                batch_import.userid == str(user.id) or 'admin' in session['authorizations']
+            ),
             'result': result
         })
-    return render_template('upload.html', form=form, imports=imports, uploadfolder=current_app.config['UPLOAD_FOLDER'])
+    return render_template('upload.html', form=form, imports=imports, uploadfolder=current_app.config['UPLOAD_FOLDER'],
+                           controlform=importcontrolform.ImportControlForm())
+
+
+# Show a time in the app's time zone (naive times from the database are UTC)
+@bp.app_template_filter('localtime')
+def localtime(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(ZoneInfo(current_app.config['TIMEZONE'])).strftime('%Y-%m-%d %H:%M %Z')
+
+
+# Cancel import handler
+@bp.route('/imports/<uuid>/cancel', methods=['POST'])
+@auth_required
+def cancel_import(uuid):
+    batch_import = get_controllable_import(uuid)
+    if batch_import.status not in active_statuses:  # Only queued, running or waiting imports can be cancelled
+        abort(400)
+    if cancel_batch(batch_import):  # If the import isn't running, cancel it now...
+        flash('The import of "' + batch_import.filename + '" has been cancelled.', 'info')
+    else:  # ...otherwise ask the task to stop; it checks for this between rows
+        set_control(uuid, 'cancel')
+        flash('The import of "' + batch_import.filename + '" is being cancelled.', 'info')
+    return redirect(url_for('upload.upload'))
+
+
+# Pause import handler
+@bp.route('/imports/<uuid>/pause', methods=['POST'])
+@auth_required
+def pause_import(uuid):
+    batch_import = get_controllable_import(uuid)
+    if batch_import.status not in ['PENDING', 'STARTED', 'SCHEDULED']:  # Only unpaused active imports can be paused
+        abort(400)
+    if pause_batch(batch_import):  # If the import isn't running, pause it now...
+        flash('The import of "' + batch_import.filename + '" has been paused.', 'info')
+    else:  # ...otherwise ask the task to pause; it checks for this between rows
+        set_control(uuid, 'pause')
+        flash('The import of "' + batch_import.filename + '" is being paused.', 'info')
+    return redirect(url_for('upload.upload'))
+
+
+# Resume import handler
+@bp.route('/imports/<uuid>/resume', methods=['POST'])
+@auth_required
+def resume_import(uuid):
+    batch_import = get_controllable_import(uuid)
+    if batch_import.status != 'PAUSED':  # Only paused imports can be resumed
+        abort(400)
+    clear_control(uuid)  # Remove the pause request so the task doesn't pause again
+    resume_batch(batch_import)
+    flash('The import of "' + batch_import.filename + '" has been resumed.', 'info')
+    return redirect(url_for('upload.upload'))
+
+
+# Get a batch import the current user may cancel, pause or resume
+def get_controllable_import(uuid):
+    form = importcontrolform.ImportControlForm()
+    if not form.validate_on_submit():  # Check the CSRF token
+        abort(400)
+    batch_import = BatchImport.get_single_batch_import(uuid)
+    if batch_import is None:
+        abort(404)
+    user = User.check_user(session['username'])
+    if batch_import.user != str(user.id) and 'admin' not in session['authorizations']:
+        abort(403)
+    return batch_import
+
+
+# Re-dispatch a paused batch import from its checkpoint under the same task id
+def resume_batch(batch_import):
+    BatchImport.set_status(batch_import.uuid, 'PENDING', checkpoint=json.loads(batch_import.checkpoint))
+    dispatch_batch(batch_import)
 
 
 @bp.route('/login')
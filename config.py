@@ -23,8 +23,37 @@ class Config:
     MEMCACHED_SERVER = os.getenv("MEMCACHED_SERVER")
     INSTITUTION_CODE = os.getenv("INSTITUTION_CODE")
     UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER")
+    TIMEZONE = os.getenv("TIMEZONE", "America/New_York")  # time zone for scheduled start times
+    REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379")
+    # seconds a cancel/pause request for a running import is kept for the task to see (longer than a chunk runs)
+    CONTROL_EXPIRES = int(os.getenv("CONTROL_EXPIRES", "86400"))
+
+    # database connection pool (pre-ping and recycle avoid errors from connections closed by MySQL's wait_timeout)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv("DB_POOL_SIZE", "5")),
+        'max_overflow': int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        'pool_pre_ping': os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        'pool_recycle': int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
+    # task state backend: 'database' (default) or 'redis'; final results are also saved to BatchImport
+    RESULT_BACKEND = os.getenv("RESULT_BACKEND", "database")
 
     CELERY = {
-        'broker_url': 'redis://127.0.0.1:6379',
-        'result_backend': 'db+' + os.getenv("DATABASE"),
+        'broker_url': REDIS_URL,
+        'result_backend': REDIS_URL if RESULT_BACKEND == "redis" else 'db+' + os.getenv("DATABASE"),
+        'result_expires': int(os.getenv("RESULT_EXPIRES", "86400")),
+        # scheduled imports and throttled chunks wait in the database, not the broker, until beat dispatches them
+        'beat_schedule': {
+            'dispatch-scheduled-imports': {
+                'task': 'app.tasks.batch.dispatch_scheduled',
+                'schedule': float(os.getenv("DISPATCH_INTERVAL", "60")),
+            },
+        },
+        # outside forked workers Celery uses a NullPool engine, which rejects pool_size and max_overflow
+        'database_engine_options': {
+            'pool_pre_ping': SQLALCHEMY_ENGINE_OPTIONS['pool_pre_ping'],
+            'pool_recycle': SQLALCHEMY_ENGINE_OPTIONS['pool_recycle'],
+        },
+        'include': ['app.tasks.batch'],
     }
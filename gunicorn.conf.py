@@ -0,0 +1,22 @@
+import multiprocessing
+import os
+import time
+
+started = time.perf_counter()  # Start the startup timer
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# Load the app once in the master and fork workers from it. create_app doesn't open database or Redis
+# connections, so no connections are shared between forked workers.
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+
+
+# Log startup time once gunicorn is ready to serve
+def when_ready(server):
+    server.log.info("Gunicorn ready in {:.3f}s".format(time.perf_counter() - started))
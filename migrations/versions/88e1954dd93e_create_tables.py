@@ -0,0 +1,60 @@
+"""create tables
+
+Revision ID: 88e1954dd93e
+Revises: 
+Create Date: 2026-10-19 11:32:41.690887
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '88e1954dd93e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created before migrations (the app used to call create_all on startup) already have these tables
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'user' not in tables:
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=255), nullable=False),
+            sa.Column('displayname', sa.String(length=255), nullable=False),
+            sa.Column('emailaddress', sa.String(length=255), nullable=True),
+            sa.Column('last_login', sa.DateTime(), nullable=True),
+            sa.Column('admin', sa.Boolean(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'institution' not in tables:
+        op.create_table(
+            'institution',
+            sa.Column('code', sa.String(length=255), nullable=False),
+            sa.Column('name', sa.String(length=255), nullable=False),
+            sa.Column('apikey', sa.String(length=255), nullable=False),
+            sa.PrimaryKeyConstraint('code')
+        )
+    if 'batch_import' not in tables:
+        op.create_table(
+            'batch_import',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('uuid', sa.String(length=255), nullable=False),
+            sa.Column('filename', sa.String(length=255), nullable=False),
+            sa.Column('field', sa.String(length=255), nullable=False),
+            sa.Column('date', sa.DateTime(), nullable=False),
+            sa.Column('user', sa.String(length=255), nullable=False),
+            sa.Column('institution', sa.String(length=255), nullable=False),
+            sa.ForeignKeyConstraint(['institution'], ['institution.code']),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('batch_import')
+    op.drop_table('institution')
+    op.drop_table('user')